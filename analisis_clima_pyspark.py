@@ -3,8 +3,11 @@ Proyecto 2 - Análisis de Datos Climáticos con PySpark
 Dataset: NOAA Climate Data (GHCN-Daily)
 """
 
+from pyspark import StorageLevel
 from pyspark.sql import SparkSession
-from pyspark.sql.functions import avg, max, min, stddev, count, sum, desc, col, when
+from pyspark.sql.functions import (
+    max, min, count, sum, desc, col, when, sqrt, greatest, lit, array, element_at
+)
 from pyspark.sql.types import *
 import matplotlib.pyplot as plt
 import pandas as pd
@@ -23,6 +26,20 @@ from utils import imprimir_banner, limpiar_archivos_temporales
 # Configurar estilo de gráficas
 plt.style.use('seaborn-v0_8-darkgrid')
 
+# Esquema de los CSV procesados (en el orden de columnas del archivo),
+# evita el recorrido extra de inferSchema
+ESQUEMA_CSV = StructType([
+    StructField("STATION", StringType()),
+    StructField("DATE", DateType()),
+    StructField("PRCP", FloatType()),
+    StructField("TMAX", FloatType()),
+    StructField("TMIN", FloatType()),
+    StructField("YEAR", IntegerType()),
+    StructField("MONTH", IntegerType()),
+    StructField("DAY", IntegerType()),
+    StructField("TEMP", FloatType())
+])
+
 
 def inicializar_spark():
     """Inicializa y configura Spark Session"""
@@ -32,7 +49,26 @@ def inicializar_spark():
     builder = SparkSession.builder
     builder = builder.appName(SPARK_CONFIG['app_name'])
     builder = builder.config("spark.driver.memory", SPARK_CONFIG['driver_memory'])
-    builder = builder.config("spark.sql.shuffle.partitions", "10")
+    # Adaptive Query Execution: parte de 200 particiones de shuffle y las
+    # combina en tiempo de ejecución según el tamaño real de cada agregación
+    builder = builder.config("spark.sql.adaptive.enabled", "true")
+    builder = builder.config("spark.sql.adaptive.coalescePartitions.enabled", "true")
+    builder = builder.config("spark.sql.adaptive.advisoryPartitionSizeInBytes", "64m")
+    builder = builder.config("spark.sql.shuffle.partitions", "200")
+    # Serialización Kryo y compresión LZ4 de shuffle, spills y RDDs cacheados
+    builder = builder.config("spark.serializer", "org.apache.spark.serializer.KryoSerializer")
+    builder = builder.config("spark.kryoserializer.buffer.max", "512m")
+    builder = builder.config("spark.shuffle.compress", "true")
+    builder = builder.config("spark.shuffle.spill.compress", "true")
+    builder = builder.config("spark.io.compression.codec", "lz4")
+    builder = builder.config("spark.rdd.compress", "true")
+    # Compresión columnar del DataFrame cacheado
+    builder = builder.config("spark.sql.inMemoryColumnarStorage.compressed", "true")
+    builder = builder.config("spark.sql.inMemoryColumnarStorage.batchSize", "10000")
+    # Arrow para convertir resultados a Pandas por lotes columnares
+    builder = builder.config("spark.sql.execution.arrow.pyspark.enabled", "true")
+    builder = builder.config("spark.sql.execution.arrow.maxRecordsPerBatch", "100000")
+    builder = builder.config("spark.driver.maxResultSize", "4g")
     spark = builder.getOrCreate()
     
     # Reducir verbosidad de logs
@@ -47,28 +83,53 @@ def inicializar_spark():
 
 def cargar_datos(spark, filepath):
     """
-    Carga datos desde CSV a PySpark DataFrame
+    Carga datos desde Parquet (o CSV) a PySpark DataFrame
     
     Args:
         spark: SparkSession
-        filepath: Path del archivo CSV
+        filepath: Path del archivo Parquet o CSV
         
     Returns:
-        DataFrame de PySpark
+        tuple: (DataFrame de PySpark cacheado, total de registros)
     """
     imprimir_banner("CARGA DE DATOS")
     
     print(f"\nArchivo: {filepath}")
     
     print("\n>>> Comando PySpark :")
-    print(f"df = spark.read.csv('{filepath}', header=True, inferSchema=True)")
+    if Path(filepath).suffix == ".parquet":
+        print(f"df = spark.read.parquet('{filepath}')")
+        
+        # Leer Parquet (columnar, con esquema incluido)
+        df = spark.read.parquet(str(filepath))
+    else:
+        print("df = spark.read.schema(ESQUEMA_CSV) \\")
+        print("    .option('header', 'true') \\")
+        print("    .option('mode', 'DROPMALFORMED') \\")
+        print(f"    .csv('{filepath}')")
+        
+        # Leer CSV con esquema explícito, descartando filas mal formadas
+        df = spark.read.schema(ESQUEMA_CSV) \
+            .option("header", "true") \
+            .option("mode", "DROPMALFORMED") \
+            .csv(str(filepath))
     
-    # Leer CSV
-    df = spark.read.csv(str(filepath), header=True, inferSchema=True)
+    print("\n>>> df = df.select('STATION', 'YEAR', 'MONTH', 'TEMP', 'PRCP')")
+    
+    # Conservar solo las columnas que usan los procesamientos
+    # (DATE, TMAX, TMIN y DAY no se leen ni se cachean)
+    df = df.select("STATION", "YEAR", "MONTH", "TEMP", "PRCP")
+    
+    print("\n>>> df = df.persist(StorageLevel.MEMORY_AND_DISK)")
+    
+    # Cachear para que los 5 procesamientos no vuelvan a leer el archivo
+    df = df.persist(StorageLevel.MEMORY_AND_DISK)
     
     print("\n>>> df.count()")
+    # count() materializa el caché
+    total_registros = df.count()
     print(f"\nInformación del dataset:")
-    print(f"   - Total registros: {df.count():,}")
+    print(f"   - Total registros: {total_registros:,}")
     print(f"   - Columnas: {len(df.columns)}")
     
     print("\n>>> df.printSchema()")
@@ -79,35 +140,151 @@ def cargar_datos(spark, filepath):
     print("\nMuestra de datos:")
     df.show(5, truncate=False)
     
-    return df
+    return df, total_registros
 
 
-def procesamiento_1_temperatura_mensual(df):
+def construir_agregado_base(df):
+    """
+    Agregación base compartida por los 5 procesamientos
+    Recorre los datos una sola vez y guarda, por estación, año, mes y
+    estación del año (SEASON_ID), los conteos, sumas, sumas de cuadrados y extremos
+    a partir de los cuales se derivan todas las estadísticas
+    
+    Args:
+        df: DataFrame de PySpark con los datos diarios
+        
+    Returns:
+        DataFrame de PySpark agregado y cacheado
+    """
+    imprimir_banner("AGREGACIÓN BASE")
+    
+    print("\n>>> df_season = df.dropna(subset=['TEMP', 'PRCP']).withColumn('SEASON_ID',")
+    print("    ((col('MONTH') % 12) / 3).cast('int')")
+    print(")")
+    print("\ntemp = col('TEMP').cast('double')")
+    print("prcp = col('PRCP').cast('double')")
+    print("\nbase = df_season.groupBy('STATION', 'YEAR', 'MONTH', 'SEASON_ID') \\")
+    print("    .agg(")
+    print("        count('*').alias('num_registros'),")
+    print("        sum(temp).alias('suma_temp'),")
+    print("        sum(temp * temp).alias('suma_temp2'),")
+    print("        max('TEMP').alias('temp_max'),")
+    print("        min('TEMP').alias('temp_min'),")
+    print("        sum(prcp).alias('suma_prcp'),")
+    print("        sum(prcp * prcp).alias('suma_prcp2'),")
+    print("        max('PRCP').alias('prcp_max'),")
+    print("        sum(temp * prcp).alias('suma_temp_prcp')")
+    print("    ) \\")
+    print("    .cache()")
+    
+    # Estación del año como entero, sin ramas por fila:
+    # 0 = Invierno (dic-feb), 1 = Primavera, 2 = Verano, 3 = Otoño
+    # (SEASON_ID depende solo de MONTH, por lo que no agrega grupos adicionales)
+    df_season = df.dropna(subset=["TEMP", "PRCP"]).withColumn("SEASON_ID", 
+        ((col("MONTH") % 12) / 3).cast("int")
+    )
+    
+    # Sumas en double para no perder precisión en los cuadrados
+    temp = col("TEMP").cast("double")
+    prcp = col("PRCP").cast("double")
+    
+    # Un solo recorrido de los datos para todos los procesamientos
+    base = df_season.groupBy("STATION", "YEAR", "MONTH", "SEASON_ID") \
+        .agg(
+            count("*").alias("num_registros"),
+            sum(temp).alias("suma_temp"),
+            sum(temp * temp).alias("suma_temp2"),
+            max("TEMP").alias("temp_max"),
+            min("TEMP").alias("temp_min"),
+            sum(prcp).alias("suma_prcp"),
+            sum(prcp * prcp).alias("suma_prcp2"),
+            max("PRCP").alias("prcp_max"),
+            sum(temp * prcp).alias("suma_temp_prcp")
+        ) \
+        .cache()
+    
+    print(f"\nGrupos en la agregación base: {base.count():,}")
+    
+    return base
+
+
+def resumir_base(base, *claves):
+    """
+    Re-agrega la agregación base a un nivel más grueso
+    
+    Args:
+        base: DataFrame devuelto por construir_agregado_base
+        *claves: Columnas por las que agrupar
+        
+    Returns:
+        DataFrame de PySpark con conteos, sumas y extremos por grupo
+    """
+    return base.groupBy(*claves) \
+        .agg(
+            sum("num_registros").alias("num_registros"),
+            sum("suma_temp").alias("suma_temp"),
+            sum("suma_temp2").alias("suma_temp2"),
+            max("temp_max").alias("temp_max"),
+            min("temp_min").alias("temp_min"),
+            sum("suma_prcp").alias("suma_prcp"),
+            sum("suma_prcp2").alias("suma_prcp2"),
+            max("prcp_max").alias("prcp_max"),
+            sum("suma_temp_prcp").alias("suma_temp_prcp")
+        )
+
+
+def desviacion_std(suma, suma2, n):
+    """
+    Desviación estándar muestral a partir de suma, suma de cuadrados y conteo
+    (equivalente a stddev() de PySpark)
+    """
+    varianza = (col(suma2) - col(suma) * col(suma) / col(n)) / (col(n) - 1)
+    # greatest() evita raíces de valores negativos por redondeo
+    return when(col(n) > 1, sqrt(greatest(varianza, lit(0.0))))
+
+
+def recolectar_pandas(df_spark):
+    """
+    Convierte a Pandas un resultado pequeño (pocos cientos de filas)
+    con collect(), evitando preparar la conversión por lotes de Arrow
+    
+    Args:
+        df_spark: DataFrame de PySpark con pocas filas
+        
+    Returns:
+        DataFrame de Pandas
+    """
+    return pd.DataFrame.from_records(df_spark.collect(), columns=df_spark.columns)
+
+
+def procesamiento_1_temperatura_mensual(base):
     """
     PROCESAMIENTO 1: Temperatura Promedio Mensual
     Calcula estadísticas mensuales de temperatura por estación
     """
     imprimir_banner("PROCESAMIENTO 1: TEMPERATURA MENSUAL")
     
-    print("\n>>> temp_mensual = df.groupBy('STATION', 'YEAR', 'MONTH') \\")
-    print("    .agg(")
-    print("        avg('TEMP').alias('temp_promedio'),")
-    print("        max('TEMP').alias('temp_maxima'),")
-    print("        min('TEMP').alias('temp_minima'),")
-    print("        stddev('TEMP').alias('desv_std'),")
-    print("        count('*').alias('num_registros')")
+    print("\n>>> temp_mensual = resumir_base(base, 'STATION', 'YEAR', 'MONTH') \\")
+    print("    .select(")
+    print("        'STATION', 'YEAR', 'MONTH',")
+    print("        (col('suma_temp') / col('num_registros')).alias('temp_promedio'),")
+    print("        col('temp_max').alias('temp_maxima'),")
+    print("        col('temp_min').alias('temp_minima'),")
+    print("        desviacion_std('suma_temp', 'suma_temp2', 'num_registros').alias('desv_std'),")
+    print("        'num_registros'")
     print("    ) \\")
     print("    .orderBy('YEAR', 'MONTH')")
     print("\n>>> temp_mensual.show(15)")
     
-    # Agregación con PySpark
-    temp_mensual = df.groupBy("STATION", "YEAR", "MONTH") \
-        .agg(
-            avg("TEMP").alias("temp_promedio"),
-            max("TEMP").alias("temp_maxima"),
-            min("TEMP").alias("temp_minima"),
-            stddev("TEMP").alias("desv_std"),
-            count("*").alias("num_registros")
+    # Agregación a partir de la base cacheada
+    temp_mensual = resumir_base(base, "STATION", "YEAR", "MONTH") \
+        .select(
+            "STATION", "YEAR", "MONTH",
+            (col("suma_temp") / col("num_registros")).alias("temp_promedio"),
+            col("temp_max").alias("temp_maxima"),
+            col("temp_min").alias("temp_minima"),
+            desviacion_std("suma_temp", "suma_temp2", "num_registros").alias("desv_std"),
+            "num_registros"
         ) \
         .orderBy("YEAR", "MONTH")
     
@@ -117,18 +294,24 @@ def procesamiento_1_temperatura_mensual(df):
     # Convertir a Pandas solo los datos agregados (pequeños)
     temp_pandas = temp_mensual.toPandas()
     
-    # Crear índice temporal para graficar
-    temp_pandas['periodo'] = temp_pandas['YEAR'].astype(str) + '-' + temp_pandas['MONTH'].astype(str).str.zfill(2)
+    # Crear índice temporal entero AAAAMM (ordena igual que 'AAAA-MM' sin
+    # convertir a texto)
+    temp_pandas['periodo'] = (
+        temp_pandas['YEAR'].to_numpy(dtype='int32') * 100 + temp_pandas['MONTH'].to_numpy(dtype='int32')
+    )
     
     # Graficar
     plt.figure(figsize=GRAFICAS_CONFIG['figsize_default'])
     
     # Tomar solo primeras estaciones para legibilidad
     estaciones_top = temp_pandas['STATION'].unique()[:3]
+    top = temp_pandas[temp_pandas['STATION'].isin(estaciones_top)]
     
-    for estacion in estaciones_top:
-        data = temp_pandas[temp_pandas['STATION'] == estacion].head(50)
-        plt.plot(range(len(data)), data['temp_promedio'], 
+    # Un solo groupby en lugar de filtrar el DataFrame por cada estación
+    # (sort=False conserva el orden de aparición y el orden año/mes)
+    for estacion, data in top.groupby('STATION', sort=False):
+        data = data.head(50)
+        plt.plot(range(len(data)), data['temp_promedio'].to_numpy(), 
                 marker='o', linewidth=2, markersize=3, label=estacion, alpha=0.7)
     
     plt.title('Temperatura Promedio Mensual por Estación', fontsize=14, fontweight='bold')
@@ -147,53 +330,55 @@ def procesamiento_1_temperatura_mensual(df):
     return temp_mensual
 
 
-def procesamiento_2_precipitacion_anual(df):
+def procesamiento_2_precipitacion_anual(base):
     """
     PROCESAMIENTO 2: Precipitación Anual
     Calcula estadísticas anuales de precipitación
     """
     imprimir_banner("PROCESAMIENTO 2: PRECIPITACIÓN ANUAL")
     
-    print("\n>>> precip_anual = df.groupBy('YEAR') \\")
-    print("    .agg(")
-    print("        sum('PRCP').alias('precip_total'),")
-    print("        avg('PRCP').alias('precip_promedio'),")
-    print("        stddev('PRCP').alias('desviacion_std'),")
-    print("        max('PRCP').alias('precip_maxima'),")
-    print("        count('*').alias('num_registros')")
+    print("\n>>> precip_anual = resumir_base(base, 'YEAR') \\")
+    print("    .select(")
+    print("        'YEAR',")
+    print("        col('suma_prcp').alias('precip_total'),")
+    print("        (col('suma_prcp') / col('num_registros')).alias('precip_promedio'),")
+    print("        desviacion_std('suma_prcp', 'suma_prcp2', 'num_registros').alias('desviacion_std'),")
+    print("        col('prcp_max').alias('precip_maxima'),")
+    print("        'num_registros'")
     print("    ) \\")
     print("    .orderBy('YEAR')")
     print("\n>>> precip_anual.show()")
     
-    # Agregación con PySpark
-    precip_anual = df.groupBy("YEAR") \
-        .agg(
-            sum("PRCP").alias("precip_total"),
-            avg("PRCP").alias("precip_promedio"),
-            stddev("PRCP").alias("desviacion_std"),
-            max("PRCP").alias("precip_maxima"),
-            count("*").alias("num_registros")
+    # Agregación a partir de la base cacheada
+    precip_anual = resumir_base(base, "YEAR") \
+        .select(
+            "YEAR",
+            col("suma_prcp").alias("precip_total"),
+            (col("suma_prcp") / col("num_registros")).alias("precip_promedio"),
+            desviacion_std("suma_prcp", "suma_prcp2", "num_registros").alias("desviacion_std"),
+            col("prcp_max").alias("precip_maxima"),
+            "num_registros"
         ) \
         .orderBy("YEAR")
     
     print("\nResultados:")
     precip_anual.show()
     
-    # Convertir a Pandas
-    precip_pandas = precip_anual.toPandas()
+    # Convertir a Pandas (un registro por año)
+    precip_pandas = recolectar_pandas(precip_anual)
     
     # Crear figura con dos subgráficas
     fig, (ax1, ax2) = plt.subplots(2, 1, figsize=GRAFICAS_CONFIG['figsize_large'])
     
     # Gráfica 1: Precipitación total anual
-    ax1.bar(precip_pandas['YEAR'], precip_pandas['precip_total'], 
+    ax1.bar(precip_pandas['YEAR'].to_numpy(), precip_pandas['precip_total'].to_numpy(), 
             color='steelblue', alpha=0.7, edgecolor='black')
     ax1.set_title('Precipitación Total Anual', fontsize=14, fontweight='bold')
     ax1.set_ylabel('Precipitación Total (mm)')
     ax1.grid(True, alpha=0.3, axis='y')
     
     # Gráfica 2: Desviación estándar
-    ax2.plot(precip_pandas['YEAR'], precip_pandas['desviacion_std'], 
+    ax2.plot(precip_pandas['YEAR'].to_numpy(), precip_pandas['desviacion_std'].to_numpy(), 
              marker='s', color='coral', linewidth=2, markersize=6)
     ax2.set_title('Variabilidad de Precipitación (Desviación Estándar)', 
                   fontsize=14, fontweight='bold')
@@ -211,40 +396,42 @@ def procesamiento_2_precipitacion_anual(df):
     return precip_anual
 
 
-def procesamiento_3_extremos_climaticos(df):
+def procesamiento_3_extremos_climaticos(base):
     """
     PROCESAMIENTO 3: Extremos Climáticos por Estación
     Identifica récords de temperatura y precipitación
     """
     imprimir_banner("PROCESAMIENTO 3: EXTREMOS CLIMÁTICOS")
     
-    print("\n>>> extremos = df.groupBy('STATION') \\")
-    print("    .agg(")
-    print("        max('TEMP').alias('temp_record_max'),")
-    print("        min('TEMP').alias('temp_record_min'),")
-    print("        max('PRCP').alias('precip_record'),")
-    print("        avg('TEMP').alias('temp_media'),")
-    print("        count('*').alias('num_observaciones')")
+    print("\n>>> extremos = resumir_base(base, 'STATION') \\")
+    print("    .select(")
+    print("        'STATION',")
+    print("        col('temp_max').alias('temp_record_max'),")
+    print("        col('temp_min').alias('temp_record_min'),")
+    print("        col('prcp_max').alias('precip_record'),")
+    print("        (col('suma_temp') / col('num_registros')).alias('temp_media'),")
+    print("        col('num_registros').alias('num_observaciones')")
     print("    ) \\")
     print("    .orderBy(desc('temp_record_max'))")
     print("\n>>> extremos.show(10, truncate=False)")
     
-    # Agregación con PySpark
-    extremos = df.groupBy("STATION") \
-        .agg(
-            max("TEMP").alias("temp_record_max"),
-            min("TEMP").alias("temp_record_min"),
-            max("PRCP").alias("precip_record"),
-            avg("TEMP").alias("temp_media"),
-            count("*").alias("num_observaciones")
+    # Agregación a partir de la base cacheada
+    extremos = resumir_base(base, "STATION") \
+        .select(
+            "STATION",
+            col("temp_max").alias("temp_record_max"),
+            col("temp_min").alias("temp_record_min"),
+            col("prcp_max").alias("precip_record"),
+            (col("suma_temp") / col("num_registros")).alias("temp_media"),
+            col("num_registros").alias("num_observaciones")
         ) \
         .orderBy(desc("temp_record_max"))
     
     print("\nResultados (Top 10 estaciones):")
     extremos.show(10, truncate=False)
     
-    # Convertir a Pandas
-    extremos_pandas = extremos.toPandas().head(10)
+    # Convertir a Pandas solo las 10 estaciones graficadas
+    extremos_pandas = recolectar_pandas(extremos.limit(10))
     
     # Graficar temperaturas extremas
     x = np.arange(len(extremos_pandas))
@@ -252,9 +439,9 @@ def procesamiento_3_extremos_climaticos(df):
     
     fig, ax = plt.subplots(figsize=GRAFICAS_CONFIG['figsize_default'])
     
-    bars1 = ax.bar(x - width/2, extremos_pandas['temp_record_max'], width, 
+    bars1 = ax.bar(x - width/2, extremos_pandas['temp_record_max'].to_numpy(), width, 
                    label='Temp. Máxima', color='red', alpha=0.7, edgecolor='black')
-    bars2 = ax.bar(x + width/2, extremos_pandas['temp_record_min'], width, 
+    bars2 = ax.bar(x + width/2, extremos_pandas['temp_record_min'].to_numpy(), width, 
                    label='Temp. Mínima', color='blue', alpha=0.7, edgecolor='black')
     
     ax.set_xlabel('Estación Meteorológica')
@@ -276,52 +463,45 @@ def procesamiento_3_extremos_climaticos(df):
     return extremos
 
 
-def procesamiento_4_analisis_estacional(df):
+def procesamiento_4_analisis_estacional(base):
     """
     PROCESAMIENTO 4: Análisis Estacional
     Compara variables climáticas por estación del año
     """
     imprimir_banner("PROCESAMIENTO 4: ANÁLISIS ESTACIONAL")
     
-    print("\n>>> df_season = df.withColumn('SEASON',")
-    print("    when((col('MONTH') >= 3) & (col('MONTH') <= 5), 'Primavera')")
-    print("    .when((col('MONTH') >= 6) & (col('MONTH') <= 8), 'Verano')")
-    print("    .when((col('MONTH') >= 9) & (col('MONTH') <= 11), 'Otoño')")
-    print("    .otherwise('Invierno')")
-    print(")")
-    print("\nestacional = df_season.groupBy('SEASON') \\")
-    print("    .agg(")
-    print("        avg('TEMP').alias('temp_promedio'),")
-    print("        avg('PRCP').alias('precip_promedio'),")
-    print("        max('TEMP').alias('temp_maxima'),")
-    print("        min('TEMP').alias('temp_minima'),")
-    print("        count('*').alias('num_observaciones')")
+    print("\n>>> nombres = array(lit('Invierno'), lit('Primavera'), lit('Verano'), lit('Otoño'))")
+    print("\nestacional = resumir_base(base, 'SEASON_ID') \\")
+    print("    .select(")
+    print("        element_at(nombres, col('SEASON_ID') + 1).alias('SEASON'),")
+    print("        (col('suma_temp') / col('num_registros')).alias('temp_promedio'),")
+    print("        (col('suma_prcp') / col('num_registros')).alias('precip_promedio'),")
+    print("        col('temp_max').alias('temp_maxima'),")
+    print("        col('temp_min').alias('temp_minima'),")
+    print("        col('num_registros').alias('num_observaciones')")
     print("    )")
     print("\n>>> estacional.show()")
     
-    # Definir estaciones del año con PySpark
-    df_season = df.withColumn("SEASON", 
-        when((col("MONTH") >= 3) & (col("MONTH") <= 5), "Primavera")
-        .when((col("MONTH") >= 6) & (col("MONTH") <= 8), "Verano")
-        .when((col("MONTH") >= 9) & (col("MONTH") <= 11), "Otoño")
-        .otherwise("Invierno")
-    )
-    
-    # Agregación
-    estacional = df_season.groupBy("SEASON") \
-        .agg(
-            avg("TEMP").alias("temp_promedio"),
-            avg("PRCP").alias("precip_promedio"),
-            max("TEMP").alias("temp_maxima"),
-            min("TEMP").alias("temp_minima"),
-            count("*").alias("num_observaciones")
+    # Nombre de cada estación del año según su SEASON_ID
+    nombres = array(lit("Invierno"), lit("Primavera"), lit("Verano"), lit("Otoño"))
+    
+    # Agregación a partir de la base cacheada, agrupando por el entero
+    # SEASON_ID y traduciendo a nombre solo los 4 grupos resultantes
+    estacional = resumir_base(base, "SEASON_ID") \
+        .select(
+            element_at(nombres, col("SEASON_ID") + 1).alias("SEASON"),
+            (col("suma_temp") / col("num_registros")).alias("temp_promedio"),
+            (col("suma_prcp") / col("num_registros")).alias("precip_promedio"),
+            col("temp_max").alias("temp_maxima"),
+            col("temp_min").alias("temp_minima"),
+            col("num_registros").alias("num_observaciones")
         )
     
     print("\nResultados por estación del año:")
     estacional.show()
     
-    # Convertir a Pandas
-    estacional_pandas = estacional.toPandas()
+    # Convertir a Pandas (4 estaciones del año)
+    estacional_pandas = recolectar_pandas(estacional)
     
     # Ordenar estaciones cronológicamente
     orden_estaciones = ['Primavera', 'Verano', 'Otoño', 'Invierno']
@@ -338,7 +518,7 @@ def procesamiento_4_analisis_estacional(df):
     colores = ['#90EE90', '#FFD700', '#FF8C00', '#4682B4']
     
     # Temperatura por estación
-    bars1 = ax1.bar(estacional_pandas['SEASON'], estacional_pandas['temp_promedio'], 
+    bars1 = ax1.bar(estacional_pandas['SEASON'].to_numpy(), estacional_pandas['temp_promedio'].to_numpy(), 
                     color=colores, alpha=0.7, edgecolor='black')
     ax1.set_title('Temperatura Promedio\npor Estación del Año', fontsize=13, fontweight='bold')
     ax1.set_ylabel('Temperatura (°C)')
@@ -352,7 +532,7 @@ def procesamiento_4_analisis_estacional(df):
                 f'{height:.1f}C', ha='center', va='bottom', fontsize=10)
     
     # Precipitación por estación
-    bars2 = ax2.bar(estacional_pandas['SEASON'], estacional_pandas['precip_promedio'], 
+    bars2 = ax2.bar(estacional_pandas['SEASON'].to_numpy(), estacional_pandas['precip_promedio'].to_numpy(), 
                     color=colores, alpha=0.7, edgecolor='black')
     ax2.set_title('Precipitación Promedio\npor Estación del Año', fontsize=13, fontweight='bold')
     ax2.set_ylabel('Precipitación (mm/día)')
@@ -375,43 +555,60 @@ def procesamiento_4_analisis_estacional(df):
     return estacional
 
 
-def procesamiento_5_tendencia_correlacion(df):
+def procesamiento_5_tendencia_correlacion(base):
     """
     PROCESAMIENTO 5: Tendencia Temporal y Correlación
     Analiza evolución temporal y relación entre variables
     """
     imprimir_banner("PROCESAMIENTO 5: TENDENCIAS Y CORRELACIÓN")
     
-    print("\n>>> tendencia = df.groupBy('YEAR') \\")
-    print("    .agg(")
-    print("        avg('TEMP').alias('temp_anual'),")
-    print("        avg('PRCP').alias('precip_anual'),")
-    print("        count('*').alias('num_registros')")
+    print("\n>>> tendencia = resumir_base(base, 'YEAR') \\")
+    print("    .select(")
+    print("        'YEAR',")
+    print("        (col('suma_temp') / col('num_registros')).alias('temp_anual'),")
+    print("        (col('suma_prcp') / col('num_registros')).alias('precip_anual'),")
+    print("        'num_registros'")
     print("    ) \\")
     print("    .orderBy('YEAR')")
     print("\n>>> tendencia.show()")
     
-    # Tendencia anual
-    tendencia = df.groupBy("YEAR") \
-        .agg(
-            avg("TEMP").alias("temp_anual"),
-            avg("PRCP").alias("precip_anual"),
-            count("*").alias("num_registros")
+    # Tendencia anual a partir de la base cacheada
+    tendencia = resumir_base(base, "YEAR") \
+        .select(
+            "YEAR",
+            (col("suma_temp") / col("num_registros")).alias("temp_anual"),
+            (col("suma_prcp") / col("num_registros")).alias("precip_anual"),
+            "num_registros"
         ) \
         .orderBy("YEAR")
     
     print("\nTendencia anual:")
     tendencia.show()
     
-    print("\n>>> correlacion = df.stat.corr('TEMP', 'PRCP')")
-    
-    # Calcular correlación con PySpark
-    correlacion = df.stat.corr("TEMP", "PRCP")
+    print("\n>>> n, sx, sy = col('num_registros'), col('suma_temp'), col('suma_prcp')")
+    print(">>> den = (n * col('suma_temp2') - sx * sx) * (n * col('suma_prcp2') - sy * sy)")
+    print(">>> correlacion = resumir_base(base).select(")
+    print("        when(den > 0, (n * col('suma_temp_prcp') - sx * sy) / sqrt(den))")
+    print("    ).first()[0]")
+    
+    # Correlación de Pearson a partir de las sumas de la base
+    # (equivalente a df.stat.corr('TEMP', 'PRCP') sin recorrer los datos)
+    n, sx, sy = col("num_registros"), col("suma_temp"), col("suma_prcp")
+    den = (n * col("suma_temp2") - sx * sx) * (n * col("suma_prcp2") - sy * sy)
+    correlacion = resumir_base(base).select(
+        when(den > 0, (n * col("suma_temp_prcp") - sx * sy) / sqrt(den))
+    ).first()[0]
+    
+    # Con varianza cero la correlación no está definida (df.stat.corr da NaN)
+    if correlacion is None:
+        correlacion = float('nan')
     print(f"\nCoeficiente de Correlación Temperatura-Precipitación: {correlacion:.4f}")
     
     # Interpretación - usar abs() de Python, no de PySpark
     import builtins
-    if builtins.abs(correlacion) < 0.3:
+    if np.isnan(correlacion):
+        interpretacion = "indefinida (varianza cero)"
+    elif builtins.abs(correlacion) < 0.3:
         interpretacion = "débil"
     elif builtins.abs(correlacion) < 0.7:
         interpretacion = "moderada"
@@ -420,8 +617,8 @@ def procesamiento_5_tendencia_correlacion(df):
     
     print(f"   Interpretación: Correlación {interpretacion}")
     
-    # Convertir a Pandas
-    tendencia_pandas = tendencia.toPandas()
+    # Convertir a Pandas (un registro por año)
+    tendencia_pandas = recolectar_pandas(tendencia)
     
     # Crear gráfica de doble eje Y
     fig, ax1 = plt.subplots(figsize=GRAFICAS_CONFIG['figsize_default'])
@@ -429,7 +626,7 @@ def procesamiento_5_tendencia_correlacion(df):
     color1 = 'tab:red'
     ax1.set_xlabel('Año', fontsize=12)
     ax1.set_ylabel('Temperatura Promedio (°C)', color=color1, fontsize=12)
-    line1 = ax1.plot(tendencia_pandas['YEAR'], tendencia_pandas['temp_anual'], 
+    line1 = ax1.plot(tendencia_pandas['YEAR'].to_numpy(), tendencia_pandas['temp_anual'].to_numpy(), 
                      color=color1, marker='o', linewidth=2.5, markersize=6, 
                      label='Temperatura', alpha=0.8)
     ax1.tick_params(axis='y', labelcolor=color1)
@@ -439,7 +636,7 @@ def procesamiento_5_tendencia_correlacion(df):
     ax2 = ax1.twinx()
     color2 = 'tab:blue'
     ax2.set_ylabel('Precipitación Promedio (mm/día)', color=color2, fontsize=12)
-    line2 = ax2.plot(tendencia_pandas['YEAR'], tendencia_pandas['precip_anual'], 
+    line2 = ax2.plot(tendencia_pandas['YEAR'].to_numpy(), tendencia_pandas['precip_anual'].to_numpy(), 
                      color=color2, marker='s', linewidth=2.5, markersize=6, 
                      label='Precipitación', alpha=0.8)
     ax2.tick_params(axis='y', labelcolor=color2)
@@ -480,49 +677,65 @@ def main():
         spark = inicializar_spark()
         
         # 2. Cargar datos
-        df = cargar_datos(spark, DATOS_PROCESADOS)
+        df, total_registros = cargar_datos(spark, DATOS_PROCESADOS)
         
-        # 3. Ejecutar los 5 procesamientos
+        # 3. Agregación base compartida (un solo recorrido de los datos)
+        base = construir_agregado_base(df)
+        
+        # La base ya está materializada (base.count() en construir_agregado_base)
+        # y nada más lee df: liberar los datos diarios cacheados
+        df.unpersist()
+        
+        # 4. Ejecutar los 5 procesamientos
         print("\n" + "="*60)
         print("EJECUTANDO 5 PROCESAMIENTOS")
         print("="*60)
         
-        resultado1 = procesamiento_1_temperatura_mensual(df)
-        resultado2 = procesamiento_2_precipitacion_anual(df)
-        resultado3 = procesamiento_3_extremos_climaticos(df)
-        resultado4 = procesamiento_4_analisis_estacional(df)
-        resultado5, correlacion = procesamiento_5_tendencia_correlacion(df)
+        resultado1 = procesamiento_1_temperatura_mensual(base)
+        resultado2 = procesamiento_2_precipitacion_anual(base)
+        resultado3 = procesamiento_3_extremos_climaticos(base)
+        resultado4 = procesamiento_4_analisis_estacional(base)
+        resultado5, correlacion = procesamiento_5_tendencia_correlacion(base)
         
-        # 4. Resumen final
+        # 5. Resumen final
         imprimir_banner("ANÁLISIS COMPLETADO")
         
         print(f"\nResumen de resultados:")
-        print(f"   - Total de registros procesados: {df.count():,}")
+        print(f"   - Total de registros procesados: {total_registros:,}")
         print(f"   - Procesamientos completados: 5/5")
         print(f"   - Gráficas generadas: 5")
         print(f"   - Directorio de resultados: {RESULTADOS_DIR}")
         
         print(f"\n>>> Comando PySpark :")
-        print("df.select(")
-        print("    avg('TEMP').alias('temp_promedio'),")
-        print("    max('TEMP').alias('temp_maxima'),")
-        print("    min('TEMP').alias('temp_minima'),")
-        print("    avg('PRCP').alias('precip_promedio')")
-        print(").show()")
+        print("resumen_temp = resultado3.agg(")
+        print("    (sum(col('temp_media') * col('num_observaciones')) / sum('num_observaciones')).alias('temp_promedio'),")
+        print("    max('temp_record_max').alias('temp_maxima'),")
+        print("    min('temp_record_min').alias('temp_minima')")
+        print(")")
+        print("resumen_precip = resultado2.agg(")
+        print("    (sum('precip_total') / sum('num_registros')).alias('precip_promedio')")
+        print(")")
+        print("resumen_temp.crossJoin(resumen_precip).show()")
         
+        # Estadísticas generales a partir de los resultados por estación y
+        # por año, sin volver a recorrer el DataFrame completo
         print(f"\nEstadísticas generales:")
-        df.select(
-            avg("TEMP").alias("temp_promedio"),
-            max("TEMP").alias("temp_maxima"),
-            min("TEMP").alias("temp_minima"),
-            avg("PRCP").alias("precip_promedio")
-        ).show()
+        resumen_temp = resultado3.agg(
+            (sum(col("temp_media") * col("num_observaciones")) / sum("num_observaciones")).alias("temp_promedio"),
+            max("temp_record_max").alias("temp_maxima"),
+            min("temp_record_min").alias("temp_minima")
+        )
+        resumen_precip = resultado2.agg(
+            (sum("precip_total") / sum("num_registros")).alias("precip_promedio")
+        )
+        resumen_temp.crossJoin(resumen_precip).show()
         
-        # 5. Cerrar Spark
+        # 6. Liberar caché y cerrar Spark
+        base.unpersist()
         spark.stop()
         print(f"\nSesión Spark finalizada")
         
-        # 6. Limpiar archivos temporales
+        # 7. Limpiar archivos temporales
         limpiar_archivos_temporales()
         
     except Exception as e:
@@ -17,8 +17,8 @@ RESULTADOS_DIR.mkdir(exist_ok=True)
 DOCS_DIR.mkdir(exist_ok=True)
 
 # Archivos de datos
-DATOS_CRUDOS = DATOS_DIR / "datos_clima_noaa.csv"
-DATOS_PROCESADOS = DATOS_DIR / "datos_clima_noaa_procesado.csv"
+DATOS_CRUDOS = DATOS_DIR / "datos_clima_noaa.parquet"
+DATOS_PROCESADOS = DATOS_DIR / "datos_clima_noaa_procesado.parquet"
 MUESTRA_5PCT = DATOS_DIR / "muestra_5porciento.csv"
 
 # Configuración de Spark
@@ -46,6 +46,13 @@ ESTACIONES_NOAA = [
 # URL base de NOAA
 NOAA_BASE_URL = "https://www.ncei.noaa.gov/data/global-historical-climatology-network-daily/access/"
 
+# Configuración de descargas
+DESCARGA_CONFIG = {
+    "max_concurrentes": 16,  # Descargas simultáneas
+    "timeout": 60,  # Segundos
+    "chunk_size": 1024 * 1024  # Bytes escritos por iteración
+}
+
 # Configuración de gráficas
 GRAFICAS_CONFIG = {
     "dpi": 300,
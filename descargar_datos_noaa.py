@@ -4,31 +4,39 @@ Dataset: Global Historical Climatology Network (GHCN-Daily)
 """
 
 import requests
+from requests.adapters import HTTPAdapter
 import os
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 from pathlib import Path
 from config import (
     DATOS_DIR, 
     ESTACIONES_NOAA, 
     NOAA_BASE_URL,
+    DESCARGA_CONFIG,
     DATOS_CRUDOS,
     DATOS_PROCESADOS,
     REQUISITOS
 )
 from utils import (
     imprimir_banner,
-    verificar_tamaño_archivo,
     listar_archivos_datos
 )
 
 
-def descargar_estacion(estacion, output_dir):
+def descargar_estacion(estacion, output_dir, session=None):
     """
     Descarga datos de una estación específica
     
     Args:
         estacion: Código de estación NOAA
         output_dir: Directorio de salida
+        session: requests.Session a reutilizar (opcional)
         
     Returns:
         str: Path del archivo descargado o None si falló
@@ -37,24 +45,25 @@ def descargar_estacion(estacion, output_dir):
         url = f"{NOAA_BASE_URL}{estacion}.csv"
         filename = output_dir / f"{estacion}.csv"
         
-        print(f"Descargando {estacion}...", end=" ", flush=True)
+        cliente = session or requests
         
-        response = requests.get(url, stream=True, timeout=60)
-        
-        if response.status_code == 200:
-            with open(filename, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            
-            tamaño_mb = os.path.getsize(filename) / (1024 * 1024)
-            print(f"OK ({tamaño_mb:.1f} MB)")
-            return filename
-        else:
-            print(f"ERROR {response.status_code}")
-            return None
+        # El bloque with devuelve la conexión al pool de la sesión
+        with cliente.get(url, stream=True, timeout=DESCARGA_CONFIG['timeout']) as response:
+            if response.status_code == 200:
+                with open(filename, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=DESCARGA_CONFIG['chunk_size']):
+                        f.write(chunk)
+                
+                tamaño_mb = os.path.getsize(filename) / (1024 * 1024)
+                # Una sola línea por estación: las descargas corren en paralelo
+                print(f"Descargando {estacion}... OK ({tamaño_mb:.1f} MB)", flush=True)
+                return filename
+            else:
+                print(f"Descargando {estacion}... ERROR {response.status_code}", flush=True)
+                return None
             
     except Exception as e:
-        print(f"ERROR: {str(e)}")
+        print(f"Descargando {estacion}... ERROR: {str(e)}", flush=True)
         return None
 
 
@@ -71,17 +80,25 @@ def descargar_todas_estaciones():
     datos_noaa_dir = DATOS_DIR / "datos_noaa"
     datos_noaa_dir.mkdir(exist_ok=True)
     
+    max_concurrentes = DESCARGA_CONFIG['max_concurrentes']
     print(f"\nDescargando {len(ESTACIONES_NOAA)} estaciones meteorológicas")
-    print(f"Destino: {datos_noaa_dir}\n")
-    
-    archivos_descargados = []
-    
-    for idx, estacion in enumerate(ESTACIONES_NOAA, 1):
-        print(f"[{idx:2d}/{len(ESTACIONES_NOAA)}] ", end="")
-        archivo = descargar_estacion(estacion, datos_noaa_dir)
-        
-        if archivo:
-            archivos_descargados.append(archivo)
+    print(f"Destino: {datos_noaa_dir}")
+    print(f"Descargas simultáneas: {max_concurrentes}\n")
+    
+    # Una sola sesión para todas las estaciones: reutiliza las conexiones
+    # TCP/TLS (keep-alive) con un pool del tamaño del número de hilos
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max_concurrentes, pool_maxsize=max_concurrentes)
+    session.mount('https://', adapter)
+    
+    # La descarga está limitada por la red: se lanzan en paralelo con un
+    # número acotado de hilos (map conserva el orden de ESTACIONES_NOAA)
+    with session, ThreadPoolExecutor(max_workers=max_concurrentes) as executor:
+        resultados = executor.map(
+            lambda estacion: descargar_estacion(estacion, datos_noaa_dir, session),
+            ESTACIONES_NOAA
+        )
+        archivos_descargados = [archivo for archivo in resultados if archivo]
     
     # Resumen
     imprimir_banner("RESUMEN DE DESCARGA")
@@ -101,7 +118,10 @@ def descargar_todas_estaciones():
 
 def unificar_archivos(archivos):
     """
-    Unifica múltiples archivos CSV en uno solo
+    Unifica múltiples archivos CSV en un solo archivo Parquet
+    
+    Cada CSV se lee completo con pyarrow.dataset y se escribe al Parquet
+    antes de pasar al siguiente, sin cargar todos los archivos en memoria
     
     Args:
         archivos: Lista de paths a archivos CSV
@@ -117,36 +137,55 @@ def unificar_archivos(archivos):
     
     print(f"\nUnificando {len(archivos)} archivos...")
     
-    dfs = []
-    for archivo in archivos:
-        try:
-            # Leer solo columnas necesarias para ahorrar memoria
-            columnas = ['STATION', 'DATE', 'TMAX', 'TMIN', 'PRCP']
-            df = pd.read_csv(archivo, usecols=lambda x: x in columnas)
-            dfs.append(df)
-            print(f"   OK {Path(archivo).name}: {len(df):,} registros")
-        except Exception as e:
-            print(f"   ERROR en {Path(archivo).name}: {e}")
-    
-    if not dfs:
+    # Leer solo columnas necesarias para ahorrar memoria
+    # (las que falten en un archivo quedan como nulos). Se conserva el orden
+    # de los CSV de NOAA, del que depende ESQUEMA_CSV en el análisis
+    esquema = pa.schema([
+        ('STATION', pa.string()),
+        ('DATE', pa.string()),
+        ('PRCP', pa.float64()),
+        ('TMAX', pa.float64()),
+        ('TMIN', pa.float64())
+    ])
+    formato = ds.CsvFileFormat(
+        read_options=pacsv.ReadOptions(block_size=64 * 1024 * 1024),
+        convert_options=pacsv.ConvertOptions(column_types=esquema)
+    )
+    
+    archivos_leidos = 0
+    registros_totales = 0
+    fechas = []
+    
+    with pq.ParquetWriter(DATOS_CRUDOS, esquema, compression='snappy') as writer:
+        for archivo in archivos:
+            try:
+                # Leer el archivo completo antes de escribirlo: si falla a
+                # medias no queda ninguno de sus registros en el Parquet
+                dataset = ds.dataset(archivo, format=formato, schema=esquema)
+                tabla = dataset.to_table(columns=esquema.names)
+                writer.write_table(tabla)
+                registros = tabla.num_rows
+                rango = pc.min_max(tabla.column('DATE'))
+                fechas.extend(f for f in (rango['min'].as_py(), rango['max'].as_py()) if f)
+                archivos_leidos += 1
+                registros_totales += registros
+                print(f"   OK {Path(archivo).name}: {registros:,} registros")
+            except Exception as e:
+                print(f"   ERROR en {Path(archivo).name}: {e}")
+    
+    if not archivos_leidos:
         print("No se pudo leer ningún archivo")
+        DATOS_CRUDOS.unlink()
         return None
     
-    # Combinar todos los DataFrames
-    print("\nCombinando datos...")
-    df_unificado = pd.concat(dfs, ignore_index=True)
-    
-    # Guardar archivo unificado
-    print(f"Guardando archivo unificado...")
-    df_unificado.to_csv(DATOS_CRUDOS, index=False)
-    
     print(f"\nArchivo unificado creado: {DATOS_CRUDOS.name}")
-    print(f"   Registros totales: {len(df_unificado):,}")
-    print(f"   Periodo: {df_unificado['DATE'].min()} a {df_unificado['DATE'].max()}")
-    print(f"   Columnas: {list(df_unificado.columns)}")
+    print(f"   Registros totales: {registros_totales:,}")
+    if fechas:
+        print(f"   Periodo: {min(fechas)} a {max(fechas)}")
+    print(f"   Columnas: {esquema.names}")
     
-    # Verificar tamaño
-    verificar_tamaño_archivo(DATOS_CRUDOS, REQUISITOS['tamaño_minimo_gb'])
+    # El requisito de tamaño mínimo se verifica sobre los CSV descargados
+    # (descargar_todas_estaciones); el Parquet comprimido no es comparable
     
     return DATOS_CRUDOS
 
@@ -168,7 +207,7 @@ def preparar_datos_para_pyspark(archivo):
     imprimir_banner("PREPARACIÓN PARA PYSPARK")
     
     print("\nLeyendo datos...")
-    df = pd.read_csv(archivo)
+    df = pd.read_parquet(archivo)
     
     print(f"   Registros iniciales: {len(df):,}")
     
@@ -182,7 +221,8 @@ def preparar_datos_para_pyspark(archivo):
     
     # 2. Convertir fechas y extraer componentes
     print("   Procesando fechas...")
-    df['DATE'] = pd.to_datetime(df['DATE'], errors='coerce')
+    # Formato ISO explícito: evita inferir el formato fila por fila
+    df['DATE'] = pd.to_datetime(df['DATE'], format='%Y-%m-%d', errors='coerce', cache=True)
     
     # Eliminar filas con fechas inválidas
     antes_fecha = len(df)
@@ -190,20 +230,24 @@ def preparar_datos_para_pyspark(archivo):
     if antes_fecha > len(df):
         print(f"   Eliminadas {antes_fecha - len(df):,} filas con fechas inválidas")
     
-    df['YEAR'] = df['DATE'].dt.year
-    df['MONTH'] = df['DATE'].dt.month
-    df['DAY'] = df['DATE'].dt.day
+    # Tipos enteros pequeños: año en int16, mes y día en int8
+    df['YEAR'] = df['DATE'].dt.year.astype('int16')
+    df['MONTH'] = df['DATE'].dt.month.astype('int8')
+    df['DAY'] = df['DATE'].dt.day.astype('int8')
     
-    # 3. Calcular temperatura promedio
-    df['TEMP'] = (df['TMAX'] + df['TMIN']) / 2
+    # 3. Calcular temperatura promedio en Celsius
+    # (promedio y conversión de décimas en una sola multiplicación)
+    df['TEMP'] = (df['TMAX'].to_numpy() + df['TMIN'].to_numpy()) * 0.05
     
-    # 4. Convertir temperaturas a Celsius (NOAA usa décimas de Celsius)
-    df['TMAX'] = df['TMAX'] / 10
-    df['TMIN'] = df['TMIN'] / 10
-    df['TEMP'] = df['TEMP'] / 10
+    # 4. Convertir temperaturas a Celsius y precipitación a mm
+    # (NOAA usa décimas de Celsius y décimas de mm)
+    columnas_decimas = ['TMAX', 'TMIN', 'PRCP']
+    df[columnas_decimas] = df[columnas_decimas].to_numpy() * 0.1
     
-    # 5. Convertir precipitación a mm (NOAA usa décimas de mm)
-    df['PRCP'] = df['PRCP'] / 10
+    # 5. Reducir tipos para disminuir los bytes escritos y leídos por Spark
+    columnas_float = ['TMAX', 'TMIN', 'TEMP', 'PRCP']
+    df[columnas_float] = df[columnas_float].astype('float32')
+    df['STATION'] = df['STATION'].astype('category')
     
     # Información del dataset procesado
     print(f"\nDataset procesado:")
@@ -219,9 +263,20 @@ def preparar_datos_para_pyspark(archivo):
     print(f"   - Temp. mínima record: {df['TMIN'].min():.1f} C")
     print(f"   - Precipitación promedio: {df['PRCP'].mean():.2f} mm/día")
     
-    # Guardar archivo procesado
+    # Guardar archivo procesado en Parquet (columnar y comprimido)
     print(f"\nGuardando datos procesados...")
-    df.to_csv(DATOS_PROCESADOS, index=False)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    
+    # DATE se guarda como fecha (sin hora); Spark no lee timestamps en
+    # nanosegundos y la columna se lee como DateType
+    indice_fecha = table.schema.get_field_index('DATE')
+    table = table.set_column(indice_fecha, 'DATE', table.column('DATE').cast(pa.date32()))
+    
+    # Compresión zstd, grupos de 1,000,000 filas y codificación de
+    # diccionario en todas las columnas (STATION, YEAR, MONTH, DAY y DATE
+    # tienen pocos valores distintos)
+    pq.write_table(table, DATOS_PROCESADOS, compression='zstd',
+                   row_group_size=1_000_000, use_dictionary=True)
     
     print(f"\nDatos listos para PySpark: {DATOS_PROCESADOS.name}")
     
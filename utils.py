@@ -4,7 +4,10 @@ Funciones auxiliares para el proyecto
 
 import os
 from pathlib import Path
-import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 from datetime import datetime
 
 
@@ -36,31 +39,71 @@ def verificar_tamaño_archivo(filepath, tamaño_min_gb=0.5):
 
 def generar_muestra(filepath_entrada, filepath_salida, porcentaje=0.05, seed=42):
     """
-    Genera una muestra aleatoria de un archivo CSV
+    Genera una muestra aleatoria de un archivo CSV o Parquet
+    
+    Cada lote leído se filtra con un muestreo de Bernoulli y se escribe
+    directamente al CSV de salida, sin acumular la muestra en memoria
     
     Args:
-        filepath_entrada: Archivo CSV completo
-        filepath_salida: Donde guardar la muestra
+        filepath_entrada: Archivo CSV o Parquet completo
+        filepath_salida: Donde guardar la muestra (CSV)
         porcentaje: Porcentaje de datos a muestrear (0.05 = 5%)
         seed: Semilla para reproducibilidad
     """
     print(f"\n[INFO] Generando muestra del {porcentaje*100}%...")
     
-    # Leer con chunks para archivos grandes
+    # Leer por lotes para archivos grandes
+    # (Parquet: lotes de 100,000 filas; CSV: bloques de 8 MB)
     chunk_size = 100000
-    sample_data = []
-    
-    for chunk in pd.read_csv(filepath_entrada, chunksize=chunk_size):
-        sample_chunk = chunk.sample(frac=porcentaje, random_state=seed)
-        sample_data.append(sample_chunk)
+    block_size = 8 * 1024 * 1024
     
-    # Combinar todos los chunks muestreados
-    muestra = pd.concat(sample_data, ignore_index=True)
-    muestra.to_csv(filepath_salida, index=False)
+    if Path(filepath_entrada).suffix == ".parquet":
+        parquet = pq.ParquetFile(filepath_entrada)
+        esquema = parquet.schema_arrow
+        lotes = parquet.iter_batches(batch_size=chunk_size)
+    else:
+        # Tipos fijos para las columnas conocidas: pyarrow solo infiere con el
+        # primer bloque y fallaría si p. ej. PRCP trae solo enteros al inicio
+        tipos = {
+            'STATION': pa.string(),
+            'DATE': pa.string(),
+            'PRCP': pa.float64(),
+            'TMAX': pa.float64(),
+            'TMIN': pa.float64(),
+            'TEMP': pa.float64(),
+            'YEAR': pa.int64(),
+            'MONTH': pa.int64(),
+            'DAY': pa.int64()
+        }
+        lotes = pacsv.open_csv(
+            filepath_entrada,
+            read_options=pacsv.ReadOptions(block_size=block_size),
+            convert_options=pacsv.ConvertOptions(column_types=tipos)
+        )
+        esquema = lotes.schema
+    
+    # En el CSV las fechas se escriben como YYYY-MM-DD y las columnas
+    # con diccionario (categóricas) como texto
+    esquema_csv = pa.schema([
+        pa.field(campo.name, pa.date32()) if pa.types.is_timestamp(campo.type)
+        else pa.field(campo.name, campo.type.value_type) if pa.types.is_dictionary(campo.type)
+        else campo
+        for campo in esquema
+    ])
+    
+    rng = np.random.default_rng(seed)
+    registros = 0
+    
+    with pacsv.CSVWriter(str(filepath_salida), esquema_csv) as writer:
+        for lote in lotes:
+            mascara = rng.random(lote.num_rows) < porcentaje
+            muestra = pa.Table.from_batches([lote.filter(pa.array(mascara))])
+            writer.write_table(muestra.cast(esquema_csv))
+            registros += muestra.num_rows
     
     tamaño_mb = os.path.getsize(filepath_salida) / (1024**2)
     print(f"[OK] Muestra guardada: {filepath_salida}")
-    print(f"   - Registros: {len(muestra):,}")
+    print(f"   - Registros: {registros:,}")
     print(f"   - Tamaño: {tamaño_mb:.2f} MB")
 
 
@@ -113,7 +156,7 @@ def listar_archivos_datos(directorio):
 
 def verificar_dependencias():
     """Verifica que todas las dependencias estén instaladas"""
-    dependencias = ['pyspark', 'pandas', 'matplotlib', 'requests']
+    dependencias = ['pyspark', 'pandas', 'pyarrow', 'matplotlib', 'requests']
     
     print("\n[INFO] Verificando dependencias...")
     todas_ok = True